@@ -11,8 +11,6 @@ from bokeh.models.widgets import HBox, Select, VBoxForm, CheckboxGroup, Checkbox
 from bokeh.models.widgets import DataTable, TableColumn
 
 # Celero recordtable parser
-import glob
-import os
 from celero_parser import *
 
 # plotting
@@ -121,6 +119,7 @@ class BenchmarkApp(HBox):
             plot_width=400,
             tools=toolset,
             title=title,
+            webgl=True,
         )
         # remove the logo
         self.plot.logo = None
@@ -224,11 +223,11 @@ class BenchmarkApp(HBox):
         elif axis_filter == 'time [ms]':
             return celero_result['times'] * 1E-3
         elif axis_filter == 'throughput [1/sec]':
-            return 1.0 / (celero_result['times'] * 1E-6)
+            return celero_result['throughput']
         elif axis_filter == 'throughput [log2(1/sec)]':
-            return np.log2(1.0 / (celero_result['times'] * 1E-6))
+            return np.log2(celero_result['throughput'])
         elif axis_filter == 'throughput [log10(1/sec)]':
-            return np.log10(1.0 / (celero_result['times'] * 1E-6))
+            return np.log10(celero_result['throughput'])
 
 
     @classmethod
@@ -252,20 +251,18 @@ class BenchmarkApp(HBox):
 
         # extract the user's input
         benchmark = self.benchmarks.value
-        devices = list(device_names[i] for i in self.device_names.active)
-        platforms = list(platform_names[i] for i in self.platform_names.active)
+        devices = set(device_names[i] for i in self.device_names.active)
+        platforms = set(platform_names[i] for i in self.platform_names.active)
         x_axis_label = self.x_axis_options.value
         y_axis_label = self.y_axis_options.value
 
 
-        # extract only the results which match this group
-        filtered_results = filter(lambda x: x['benchmark_name'] == benchmark, celero_results)
-        # remove the baseline measurements from the plots
-        filtered_results = filter(lambda x: x['benchmark_name'] != "Baseline", filtered_results)
-
-        # select the desired devices
-        filtered_results = filter(lambda x: x['extra_data']['AF_DEVICE'] in devices, filtered_results)
-        filtered_results = filter(lambda x: x['extra_data']['AF_PLATFORM'] in platforms, filtered_results)
+        # extract only the results which match this benchmark on the desired
+        # devices and platforms
+        filtered_results = [x for x in celero_results
+            if x['benchmark_name'] == benchmark
+            and get_recordTable_attribute(x, 'AF_DEVICE') in devices
+            and get_recordTable_attribute(x, 'AF_PLATFORM') in platforms]
 
         # extract the data
         sources = dict()
@@ -278,8 +275,8 @@ class BenchmarkApp(HBox):
             y_id, device_id, platform_id = self.make_field_ids(result_number)
 
             # Extract the results from the benchmark
-            platform = result['extra_data']['AF_PLATFORM']
-            device = result['extra_data']['AF_DEVICE']
+            platform = get_recordTable_attribute(result, 'AF_PLATFORM')
+            device = get_recordTable_attribute(result, 'AF_DEVICE')
 
             x = self.getXY(result, x_axis_label)
             y = self.getXY(result, y_axis_label)
@@ -320,21 +317,6 @@ class BenchmarkApp(HBox):
             dest.data['platform'] = src[platform_id]
             dest._dirty = True
 
-def import_directory(directory):
-    """
-    Creates a list of all .csv files in a directory, imports them using
-    read_celero_recordTable, and returns the result.
-    """
-
-    csv_files = glob.glob(directory + "/*.csv")
-
-    results = list()
-
-    for filename in csv_files:
-        results.extend(read_celero_recordTable(filename))
-
-    return results
-
 # maximum number of plots, currently limited by source[0,1,2,3] variables
 # defined in BenchmarkApp
 MAX_PLOTS = 10
@@ -349,7 +331,6 @@ celero_results = import_directory(data_dir)
 
 # Get a list of all of the benchmarks
 benchmark_names = list_recordTable_benchmarks(celero_results)
-benchmark_names = filter(lambda x: x != "Baseline", benchmark_names)
 
 platform_names = list_recordTable_attribute(celero_results, 'AF_PLATFORM')
 device_names = list_recordTable_attribute(celero_results, 'AF_DEVICE')
@@ -1,46 +1,46 @@
+from __future__ import print_function
 # general functionality
+import sys
+import os
+import glob
+import hashlib
+import pickle
+import re
 import numpy as np
 
-class read_state():
-    """A class representing an enumerated state of the Celero file reader
-    """
-    start = 0
-    header = 1
-    result_row = 2
-    finished = 3
+# Parsed recordTable files are cached here, keyed by their path. Increment
+# CACHE_VERSION whenever the structure of the parsed results changes.
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "af_bench")
+CACHE_VERSION = 2
 
-def list_recordTable_attribute(results, attribute):
+# Matches the data size fields of a recordTable header row
+IS_DATA_SIZE = re.compile(r'^\d+$').match
 
-    entries = list()
-    for result in results:
-        entries.append(result['extra_data'][attribute])
+def get_recordTable_attribute(result, attribute, default=None):
+    """Returns the value of an extra attribute (e.g. AF_DEVICE) of a result,
+    or default if the result does not have that attribute
+    """
+    index = result['extra_fields'].get(attribute)
+    if index is None or index >= len(result['extra_values']):
+        return default
 
-    unique_entries = set(entries)
-    unique_entries = sorted(unique_entries)
-    return unique_entries
+    return result['extra_values'][index]
+
+def list_recordTable_attribute(results, attribute):
+    """Returns a unique sorted list of all values of an extra attribute
+    """
+    return sorted({get_recordTable_attribute(result, attribute)
+        for result in results})
 
 def list_recordTable_benchmarks(results):
     """Returns a unique sorted list of all benchmarks
     """
-    all_benchmarks = list()
-    for result in results:
-        all_benchmarks.append(result['benchmark_name'])
-
-    unique_benchmarks = set(all_benchmarks)
-    unique_benchmarks = sorted(unique_benchmarks)
-
-    return unique_benchmarks
+    return sorted({result['benchmark_name'] for result in results})
 
 def list_recordTable_groups(results):
     """Returns a unique sorted list of all groups of benchmarks
     """
-    all_groups = list()
-    for result in results:
-        all_groups.append(result['group'])
-
-    unique_groups = set(all_groups)
-    unique_groups = sorted(unique_groups)
-    return unique_groups
+    return sorted({result['group'] for result in results})
 
 def parse_celero_recordTable_header(header_row):
     """
@@ -55,25 +55,101 @@ def parse_celero_recordTable_header(header_row):
 
     """
 
-    data_sizes = filter(lambda x: x.isdigit(), header_row)
-    other_fields = filter(lambda x: not x.isdigit(), header_row)
-    other_fields = filter(lambda x: x != "", other_fields)
+    # classify every field in one pass, numeric fields are data sizes
+    data_sizes = list()
+    other_fields = list()
+    for field in header_row:
+        if IS_DATA_SIZE(field):
+            data_sizes.append(field)
+        elif field != "":
+            other_fields.append(field)
+
+    data_sizes = np.asarray(data_sizes, dtype=np.int64)
 
     split_start = len(other_fields) + 1
     split_end = split_start + len(data_sizes)
 
-    data_sizes = map(int, data_sizes)
-    data_sizes = np.array(data_sizes)
-
     return [data_sizes, other_fields, split_start, split_end]
 
+def parse_celero_recordTable_times(result_rows, split_start, split_end):
+    """
+    Converts the timing columns of a block of Celero recordTable result rows
+    to floating point values with a single np.asarray call. Returns a list of
+    the following structures:
+
+        times - 2D np.ndarray with one row of times per result row, entries
+                missing from short rows are set to NaN
+        n_times - the number of times found on each result row
+
+    A ValueError is raised if any of the times is not a number.
+    """
+
+    n_columns = split_end - split_start
+
+    n_times = list()
+    time_rows = list()
+    for row in result_rows:
+        t_times = row[split_start:split_end]
+        n_times.append(len(t_times))
+        # pad short rows so that every row has the same number of columns
+        time_rows.append(t_times + ['nan'] * (n_columns - len(t_times)))
+
+    times = np.asarray(time_rows, dtype=np.float64)
+    times = times.reshape(len(time_rows), n_columns)
+
+    return [times, n_times]
+
+def parse_celero_recordTable_rows(result_lines, split_start, split_end):
+    """
+    Parses a block of Celero recordTable result rows. Returns a list of the
+    following structures:
+
+        result_rows - list of fields on each row, starting with the benchmark
+                      name and extra fields
+        times - 2D np.ndarray with one row of times per result row
+        n_times - the number of times found on each result row
+
+    When every row has all of its fields, the timing columns are read directly
+    from the lines with a single np.loadtxt call. Otherwise each row is split
+    into fields and converted by parse_celero_recordTable_times.
+    """
+
+    n_columns = split_end - split_start
+
+    # only the benchmark name and extra fields need to be split off here
+    result_rows = [line.split(',', split_start)[0:split_start]
+        for line in result_lines]
+    # every row must also have a field for each data size
+    fixed_layout = all(len(row) == split_start and "" not in row
+        and line.count(',') >= split_end - 1
+        for line, row in zip(result_lines, result_rows))
+
+    if fixed_layout and len(result_lines) > 0 and n_columns > 0:
+        try:
+            times = np.loadtxt(result_lines, dtype=np.float64, comments=None,
+                delimiter=',', usecols=range(split_start, split_end), ndmin=2)
+            return [result_rows, times, [n_columns] * len(result_lines)]
+        except (ValueError, IndexError):
+            # missing or malformed times, use the general parser below
+            pass
+
+    # split the rows, remove empty fields
+    result_rows = [[x for x in line.split(',') if x != ""]
+        for line in result_lines]
+    [times, n_times] = parse_celero_recordTable_times(result_rows,
+        split_start, split_end)
+
+    return [result_rows, times, n_times]
+
 def read_celero_recordTable(filename):
     """
     Splits a group of Celero test results into individual results which can
     be plotted.
     """
 
-    infile = open(filename, 'r')
+    # read the whole file with one large buffered read
+    with open(filename, 'r', buffering=1 << 20) as infile:
+        lines = infile.read().splitlines()
 
     # The results are structured as follows
     #  group_name0,...
@@ -84,78 +160,187 @@ def read_celero_recordTable(filename):
     #  '',... (or otherwise blank)
     #  group_name1,...
 
+    # split the file into blocks of rows, one block per group
+    blocks = list()
+    block = list()
+    for line in lines:
+
+        # check for the end of the group, a row with only empty fields
+        if line.strip(',') == "":
+            if len(block) > 0:
+                blocks.append(block)
+            block = list()
+            continue
+
+        block.append(line)
+
+    if len(block) > 0:
+        blocks.append(block)
+
     # output variables
     output = list()
-    # state and data variables
-    state = read_state.start
-    group = ""
-    data_sizes = list()
-    other_fields = list()
-    split_start = 0
-    split_end = 0
-
-    for line in infile:
-
-        # End of a group, clear variables
-        if state == read_state.finished:
-            group = ""
-            data_sizes = list()
-            other_fields = list()
-            split_start = 0
-            split_end = 0
-            # reset the read state
-            state = read_state.start
-
-        # strip off newline, split the line, remove empty fields
-        line = line.strip("\n")
-        line = line.strip("\r")
-        line = line.split(',')
-        line = filter(lambda x: x != "", line)
-
-        # check for the end of the group
-        if len(line) == 0:
-            state = read_state.finished
+
+    for block in blocks:
+        # a group needs both the group ID and header rows
+        if len(block) < 2:
             continue
 
         # group ID row
-        if state == read_state.start:
-            group_name = line[0]
-            state = read_state.header
-            continue
+        group_name = [x for x in block[0].split(',') if x != ""][0]
 
         # header row
-        if state == read_state.header:
-            [data_sizes, other_fields, split_start, split_end] = parse_celero_recordTable_header(line)
-            state = read_state.result_row
-            continue
-
-        # result row
-        if state == read_state.result_row:
+        header_row = [x for x in block[1].split(',') if x != ""]
+        [data_sizes, other_fields, split_start, split_end] = parse_celero_recordTable_header(header_row)
+        # map of extra field name to column, shared by every result in the group
+        extra_fields = dict((field, i) for i, field in enumerate(other_fields))
+
+        # result rows, all times in the group are parsed at once
+        try:
+            [result_rows, times, n_times] = parse_celero_recordTable_rows(
+                block[2:], split_start, split_end)
+        except ValueError as error:
+            print("Failed to parse group " + group_name + " in " + filename + "\n")
+            print(error)
+            sys.exit(1)
+
+        for i in range(0, len(result_rows)):
+            line = result_rows[i]
             benchmark_name = line[0]
 
-            other_data = line[1:split_start]
-            t_times = line[split_start:split_end]
-            try:
-                t_times = map(float, t_times)
-            except:
-                print "Failed to parse line in " + filename + "\n"
-                print line
-                print t_times
-                exit()
-
-            t_times = np.array(t_times)
+            # baseline measurements are never plotted, skip them here
+            if benchmark_name == "Baseline":
+                continue
+
+            other_data = tuple(line[1:split_start])
+            t_times = times[i, 0:n_times[i]]
+
             t_data_sizes = data_sizes
             if len(t_data_sizes) > len(t_times):
                 t_data_sizes = t_data_sizes[0: len(t_times)]
 
-            extra_data = dict(zip(other_fields, other_data))
+            # Celero reports times in microseconds. Quantities derived from the
+            # sizes and times are computed once here rather than per plot.
+            # A zero time gives an infinite throughput, don't warn about it
+            # every time the file is imported.
+            with np.errstate(divide='ignore'):
+                throughput = 1.0 / (t_times * 1E-6)
 
             result = {'group': group_name, 'benchmark_name': benchmark_name,
                 'data_sizes': t_data_sizes, 'times': t_times,
-                'extra_data': extra_data}
+                'sqrt_data_sizes': np.sqrt(t_data_sizes),
+                'throughput': throughput,
+                'extra_fields': extra_fields, 'extra_values': other_data}
 
             output.append(result)
 
     return output
 
+def recordTable_cache_entry(filename, cache_dir=CACHE_DIR):
+    """
+    Returns the key describing the current version of filename and the path
+    of its cache file.
+    """
+
+    filename = os.path.abspath(filename)
+    key = [CACHE_VERSION, filename, os.path.getmtime(filename),
+        os.path.getsize(filename)]
+    cache_file = os.path.join(cache_dir,
+        hashlib.sha1(filename.encode('utf-8')).hexdigest() + ".pkl")
+
+    return [key, cache_file]
+
+def load_recordTable_cache(filename, cache_dir=CACHE_DIR):
+    """
+    Returns the cached output of read_celero_recordTable for filename, or None
+    if there is no cached output for the current version of the file.
+    """
+
+    [key, cache_file] = recordTable_cache_entry(filename, cache_dir)
+
+    try:
+        with open(cache_file, 'rb') as infile:
+            [cached_key, output] = pickle.load(infile)
+        if cached_key == key:
+            return output
+    except Exception:
+        # missing or unreadable cache entries are simply regenerated
+        pass
+
+    return None
+
+def save_recordTable_cache(cache_entry, output, cache_dir=CACHE_DIR):
+    """
+    Caches the output of read_celero_recordTable under cache_entry, the
+    [key, cache_file] pair returned by recordTable_cache_entry before the
+    file was read.
+    """
+
+    [key, cache_file] = cache_entry
+
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open(cache_file, 'wb') as outfile:
+            pickle.dump([key, output], outfile, pickle.HIGHEST_PROTOCOL)
+    except (IOError, OSError):
+        # the cache is optional, carry on if it cannot be written
+        pass
+
+def read_celero_recordTable_cached(filename, cache_dir=CACHE_DIR):
+    """
+    Returns the output of read_celero_recordTable for filename, reusing the
+    output of a previous call if the file has not been modified since.
+    """
+
+    output = load_recordTable_cache(filename, cache_dir)
+    if output is None:
+        # describe the file before it is read, so that changes made while
+        # it is parsed invalidate the cache entry
+        cache_entry = recordTable_cache_entry(filename, cache_dir)
+        output = read_celero_recordTable(filename)
+        save_recordTable_cache(cache_entry, output, cache_dir)
+
+    return output
+
+def import_directory(directory, cache_dir=CACHE_DIR):
+    """
+    Creates a list of all .csv files in a directory, imports them using
+    read_celero_recordTable, and returns the result. Files which are not
+    cached are parsed in parallel, one file per process, when
+    concurrent.futures is available (Python 2 needs the futures backport).
+    """
+
+    csv_files = glob.glob(directory + "/*.csv")
+
+    # use the cached output where possible
+    outputs = dict()
+    for filename in csv_files:
+        outputs[filename] = load_recordTable_cache(filename, cache_dir)
+
+    stale_files = [x for x in csv_files if outputs[x] is None]
+    # describe the files before they are read, so that changes made while
+    # they are parsed invalidate the cache entries
+    cache_entries = [recordTable_cache_entry(x, cache_dir) for x in stale_files]
+
+    # parse everything else, in parallel if there is more than one file
+    try:
+        from concurrent.futures import ProcessPoolExecutor
+    except ImportError:
+        ProcessPoolExecutor = None
+
+    if len(stale_files) > 1 and ProcessPoolExecutor is not None:
+        with ProcessPoolExecutor() as executor:
+            parsed = list(executor.map(read_celero_recordTable, stale_files))
+    else:
+        parsed = [read_celero_recordTable(x) for x in stale_files]
+
+    for filename, cache_entry, output in zip(stale_files, cache_entries, parsed):
+        save_recordTable_cache(cache_entry, output, cache_dir)
+        outputs[filename] = output
+
+    results = list()
+
+    for filename in csv_files:
+        results.extend(outputs[filename])
 
+    return results
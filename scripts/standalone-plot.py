@@ -1,8 +1,10 @@
 #!/usr/bin/python
 
+from __future__ import print_function, division
 # general functionality
-import glob
+import sys
 import numpy as np
+import pandas as pd
 import argparse
 import os
 # recordtable parsing
@@ -11,9 +13,10 @@ from celero_parser import *
 import math
 import itertools
 import bokeh.plotting as bplt
-from bokeh.models import HoverTool
+from bokeh.models import HoverTool, Legend
 from bokeh.models.widgets import Select
-from bokeh.io import output_file, save, vform
+from bokeh.io import save, vform
+from bokeh.resources import INLINE
 
 # valid types for the axes
 axis_options = ['time', 'size', 'sqrt-size', 'log2size', 'log10size',
@@ -39,33 +42,33 @@ def format_data(benchmark, axis_type):
         data = sizes
         label = "Size"
     elif axis_type == 'sqrt-size':
-        data = np.sqrt(sizes)
+        data = benchmark['sqrt_data_sizes']
         label = "Square Root (size)"
     elif axis_type == 'log2size':
         data = np.log2(sizes)
     elif axis_type == 'log10size':
         data = np.log10(sizes)
     elif axis_type == 'throughput':
-        data = 1.0 / times
+        data = benchmark['throughput']
         label = "Throughput (1 / sec)"
     elif axis_type == 'log2throughput':
-        data = np.log2(1.0 / times)
+        data = np.log2(benchmark['throughput'])
         label = "Throughput (log2(1/sec))"
     elif axis_type == 'log10throughput':
-        data = np.log10(1.0 / times)
+        data = np.log10(benchmark['throughput'])
         label = "Throughput (log10(1/sec))"
 
     # Problems that produce FLOPS
     elif axis_type == 'matmul-flops':
         # Use 8/3 n^3 to calculate FLOPs according to Intel's documentation
         # https://software.intel.com/en-us/articles/significant-performance-improvment-of-symmetric-eigensolvers-and-svd-in-intel-mkl-112
-        sizes = np.sqrt(sizes)
+        sizes = benchmark['sqrt_data_sizes']
         data = 8/3 * np.power(sizes, 3) / times * 1E-9
         label = "GFLOPS"
 
     # Problems that produce FFT2D FLOPS
     elif axis_type == 'fft2d-flops':
-        sizes = np.sqrt(sizes)
+        sizes = benchmark['sqrt_data_sizes']
         data = 10 * np.power(sizes, 2) * np.log2(sizes) / times * 1E-9
         label = "GFLOPS"
 
@@ -112,81 +115,97 @@ def unique_colors():
 
     return colors
 
-def filter_benchmarks(all_benchmarks, include_benchmarks, exclude_benchmarks,
-    include_groups, exclude_groups,
-    include_devices, include_backends, include_revisions, include_data_types,
-    include_operating_systems):
+def color_key(benchmark):
+    """Returns the (device, platform, os) tuple that a benchmark's plot color
+    is assigned to
+    """
+    return (get_recordTable_attribute(benchmark, 'AF_DEVICE', ""),
+        get_recordTable_attribute(benchmark, 'AF_PLATFORM', ""),
+        get_recordTable_attribute(benchmark, 'AF_OS', ""))
 
-    filtered_benchmarks = list()
-    # Generate a few booleans to speed up comps in the loop below
-    filter_ib = len(include_benchmarks) > 0
-    filter_eb = len(exclude_benchmarks) > 0
-    filter_ig = len(include_groups) > 0
-    filter_eg = len(exclude_groups) > 0
-    filter_id = len(include_devices) > 0
-    filter_ibe = len(include_backends) > 0
-    filter_ir = len(include_revisions) > 0
-    filter_idt = len(include_data_types) > 0
-    filter_os = len(include_operating_systems) > 0
+def assign_colors(benchmarks):
+    """Assigns a color to every (device, platform, os) found in benchmarks so
+    that each device is drawn in the same color on every plot
+    """
+    keys = sorted({color_key(benchmark) for benchmark in benchmarks})
+    return dict(zip(keys, unique_colors()))
 
-    for benchmark in all_benchmarks:
-        # benchmarks are Python dicts with the following fileds
-        # group, benchmark_name, data_sizes, times
-        # extra_data = {...}
+def recordTable_dataframe(benchmarks):
+    """
+    Tabulates the names, groups, and extra attributes of a list of benchmarks
+    in a pandas DataFrame. Row i of the table describes benchmarks[i].
+    """
 
-        # remove baseline measurements
-        if benchmark['benchmark_name'] == "Baseline":
-            continue
+    # object columns keep the string accessors usable on an empty table
+    table = pd.DataFrame({
+        'benchmark_name': [b['benchmark_name'] for b in benchmarks],
+        'group': [b['group'] for b in benchmarks],
+    }, dtype=object)
 
-        if filter_ib and benchmark['benchmark_name'] not in include_benchmarks:
-            continue
+    for attribute in ['AF_DEVICE', 'AF_PLATFORM', 'AF_REVISION', 'AF_OS']:
+        table[attribute] = [get_recordTable_attribute(b, attribute)
+            for b in benchmarks]
 
-        if filter_eb and benchmark['benchmark_name'] in exclude_benchmarks:
-            continue
+    return table
 
-        if filter_ig and benchmark['group'] not in include_groups:
-            continue
+def filter_benchmarks(all_benchmarks, include_benchmarks, exclude_benchmarks,
+    include_groups, exclude_groups,
+    include_devices, include_backends, include_revisions, include_data_types,
+    include_operating_systems):
 
-        if filter_eg and benchmark['group'] in exclude_groups:
-            continue
+    # benchmarks are Python dicts with the following fileds
+    # group, benchmark_name, data_sizes, times, sqrt_data_sizes, throughput
+    # extra_fields = {name: column}, extra_values = (...)
+    # The filters are applied as boolean masks over a table of these fields.
+    table = recordTable_dataframe(all_benchmarks)
+    names = table['benchmark_name']
 
-        if filter_id and benchmark['extra_data']['AF_DEVICE'] not in include_devices:
-            continue
+    # baseline measurements are already removed by read_celero_recordTable
+    keep = pd.Series(True, index=table.index)
 
-        if filter_ibe and benchmark['extra_data']['AF_PLATFORM'] not in include_backends:
-            continue
+    if len(include_benchmarks) > 0:
+        keep &= names.isin(include_benchmarks)
 
-        if filter_ir and benchmark['extra_data']['AF_REVISION'] not in include_revisions:
-            continue
+    if len(exclude_benchmarks) > 0:
+        keep &= ~names.isin(exclude_benchmarks)
 
-        if filter_os and benchmark['extra_data']['AF_OS'] not in include_operating_systems:
-            continue
+    if len(include_groups) > 0:
+        keep &= table['group'].isin(set(include_groups))
 
-        # All Benchmark functions are prefixed by 3-character data types
-        if filter_idt and x[-3:] not in include_data_types:
-            continue
+    if len(exclude_groups) > 0:
+        keep &= ~table['group'].isin(set(exclude_groups))
 
-        filtered_benchmarks.append(benchmark)
+    if len(include_devices) > 0:
+        keep &= table['AF_DEVICE'].isin(include_devices)
 
-    return filtered_benchmarks
+    if len(include_backends) > 0:
+        keep &= table['AF_PLATFORM'].isin(include_backends)
 
-def import_directory(directory):
-    """
-    Creates a list of all .csv files in a directory, imports them using
-    read_celero_recordTable, and returns the result.
-    """
+    if len(include_revisions) > 0:
+        keep &= table['AF_REVISION'].isin(include_revisions)
 
-    csv_files = glob.glob(directory + "/*.csv")
+    if len(include_operating_systems) > 0:
+        keep &= table['AF_OS'].isin(include_operating_systems)
 
-    benchmarks = list()
+    # All Benchmark functions are suffixed by 3-character data types
+    if len(include_data_types) > 0:
+        keep &= names.str[-3:].isin(include_data_types)
+
+    return [all_benchmarks[i] for i in np.flatnonzero(keep.values)]
 
-    for filename in csv_files:
-        benchmarks.extend(read_celero_recordTable(filename))
+def add_legend_entry(legends, label, renderer):
+    """Adds renderer to the entry for label in legends, a list of
+    (label, [renderers]) tuples, creating the entry if it does not exist
+    """
+    for entry_label, renderers in legends:
+        if entry_label == label:
+            renderers.append(renderer)
+            return
 
-    return benchmarks
+    legends.append((label, [renderer]))
 
 def plot_benchmark(savefile, benchmarks, title, xaxis_type, yaxis_type,
-    save_prefix=""):
+    save_prefix="", color_map=None):
 
     show_backends = False
     show_os = False
@@ -201,11 +220,12 @@ def plot_benchmark(savefile, benchmarks, title, xaxis_type, yaxis_type,
         show_os = True
 
     # Sort the benchmarks by device name
-    bmarks_sorted = sorted(benchmarks, key=lambda k: k['extra_data']['AF_DEVICE'])
+    bmarks_sorted = sorted(benchmarks, key=lambda k: get_recordTable_attribute(k, 'AF_DEVICE'))
     benchmarks = bmarks_sorted
 
     # configure the colors
-    colors = unique_colors()
+    if color_map is None:
+        color_map = assign_colors(benchmarks)
 
     # configure the hover box
     hover = HoverTool(
@@ -216,36 +236,39 @@ def plot_benchmark(savefile, benchmarks, title, xaxis_type, yaxis_type,
             ("(x,y)", "(@x,@y)")
         ])
 
-    # configure the plot title and axis labels, use CDN for the data source
-    #bplt.output_file(save_prefix + savefile + ".html", title=title, mode='cdn')
-    bplt.output_file(save_prefix + savefile + ".html", title=title)
-    plot = bplt.figure(title=title, tools=[hover,'save,box_zoom,resize,reset'])
+    # configure the plot title and axis labels
+    # render the glyphs with WebGL, the axes and labels are still drawn on the canvas
+    plot = bplt.figure(title=title, tools=[hover,'save,box_zoom,resize,reset'],
+        webgl=True)
     xlabel = ""
     ylabel = ""
     legend_location = "top_right"
 
     # plot images/second vs. data size
-    scatter_renderers = list()
+    # The markers for all benchmarks are collected here and drawn by a single
+    # scatter renderer below. The legend has one entry per label, shared by
+    # every line with that label.
+    points = dict(x=[], y=[], color=[], device=[], platform=[], os=[])
+    legends = list()
     for benchmark in benchmarks:
         # get the color we will use for this plot
-        color = colors.next()
+        color = color_map[color_key(benchmark)]
 
         # extract benchmarks
         x,xlabel,legend_location = format_data(benchmark, xaxis_type)
         y,ylabel,legend_location = format_data(benchmark, yaxis_type)
-        platform = benchmark['extra_data']['AF_PLATFORM']
+        platform = get_recordTable_attribute(benchmark, 'AF_PLATFORM')
         # get the device name, override if necessary
-        device = benchmark['extra_data']['AF_DEVICE']
-        operating_system = benchmark['extra_data']['AF_OS']
-        if 'AF_LABEL' in benchmark['extra_data'].keys():
-            device = benchmark['extra_data']['AF_LABEL']
-
-        source = bplt.ColumnDataSource(
-            data = dict(x=x,y=y,
-                device=[device]*len(x),
-                platform=[platform]*len(x),
-                os=[operating_system]*len(x),
-            ))
+        device = get_recordTable_attribute(benchmark, 'AF_DEVICE')
+        operating_system = get_recordTable_attribute(benchmark, 'AF_OS')
+        device = get_recordTable_attribute(benchmark, 'AF_LABEL', device)
+
+        points['x'].append(x)
+        points['y'].append(y)
+        points['color'].append([color]*len(x))
+        points['device'].append([device]*len(x))
+        points['platform'].append([platform]*len(x))
+        points['os'].append([operating_system]*len(x))
 
         # Generate the legend, automatically add the platform if needed
         legend = device
@@ -258,27 +281,33 @@ def plot_benchmark(savefile, benchmarks, title, xaxis_type, yaxis_type,
         if show_os or show_backends:
             legend += ")"
 
-        # generate the plot
-        plot.line(x,y, legend=legend, color=color, line_width=2)
-        sr = plot.scatter('x', 'y', source=source, legend=legend, color=color,
-            fill_color="white", size=8)
-        scatter_renderers.append(sr)
+        # generate the plot, lines with the same label share a legend entry
+        line = plot.line(x,y, color=color, line_width=2)
+        add_legend_entry(legends, legend, line)
+
+    # concatenate the per-benchmark columns into one data source
+    for key in points.keys():
+        points[key] = np.concatenate(points[key])
+
+    source = bplt.ColumnDataSource(data=points)
+    sr = plot.scatter('x', 'y', source=source, line_color='color',
+        fill_color="white", size=8)
 
-    hover = plot.select(HoverTool)
-    hover.renderers = scatter_renderers
+    hover.renderers = [sr]
 
     plot.xaxis.axis_label = xlabel
     plot.yaxis.axis_label = ylabel
-    plot.legend.location = legend_location
+    plot.add_layout(Legend(legends=legends, location=legend_location))
 
-    # save the plot
-    bplt.save(plot)
+    # save the plot, embedding BokehJS. Use resources=CDN to link it instead.
+    save(plot, filename=save_prefix + savefile + ".html", title=title,
+        resources=INLINE)
 
 def plot_merged_benchmark(savefile, benchmarks, title, xaxis_type, yaxis_type,
     save_prefix=""):
 
     # Sort the benchmarks by device name
-    bmarks_sorted = sorted(benchmarks, key=lambda k: k['extra_data']['AF_DEVICE'])
+    bmarks_sorted = sorted(benchmarks, key=lambda k: get_recordTable_attribute(k, 'AF_DEVICE'))
     benchmarks = bmarks_sorted
 
     # configure the colors
@@ -295,65 +324,75 @@ def plot_merged_benchmark(savefile, benchmarks, title, xaxis_type, yaxis_type,
             ("(x,y)", "(@x,@y)")
         ])
 
-    # configure the plot title and axis labels, use CDN for the data source
-    #bplt.output_file(save_prefix + savefile + ".html", title=title, mode='cdn')
-    bplt.output_file(save_prefix + savefile + ".html", title=title)
-    plot = bplt.figure(title=title, tools=[hover,'save,box_zoom,resize,reset'])
+    # configure the plot title and axis labels
+    # render the glyphs with WebGL, the axes and labels are still drawn on the canvas
+    plot = bplt.figure(title=title, tools=[hover,'save,box_zoom,resize,reset'],
+        webgl=True)
     xlabel = ""
     ylabel = ""
     legend_location = "top_right"
 
     # plot images/second vs. data size
-    scatter_renderers = list()
+    # The markers for all benchmarks are collected here and drawn by a single
+    # scatter renderer below. The legend has one entry per label, shared by
+    # every line with that label.
+    points = dict(x=[], y=[], color=[], device=[], benchmark=[], platform=[],
+        os=[])
+    legends = list()
     for benchmark in benchmarks:
         bmark_name = benchmark['benchmark_name']
 
         # Look up the color
-        device = benchmark['extra_data']['AF_DEVICE']
-        platform = benchmark['extra_data']['AF_PLATFORM']
-        operating_system = benchmark['extra_data']['AF_OS']
+        device = get_recordTable_attribute(benchmark, 'AF_DEVICE')
+        platform = get_recordTable_attribute(benchmark, 'AF_PLATFORM')
+        operating_system = get_recordTable_attribute(benchmark, 'AF_OS')
 #        key = device
         key = bmark_name + device + platform
         if key in assigned_colors:
             color = assigned_colors[key]
         else:
-            color = colors.next()
+            color = next(colors)
             assigned_colors[key] = color
 
         # extract benchmarks
         x,xlabel,legend_location = format_data(benchmark, xaxis_type)
         y,ylabel,legend_location = format_data(benchmark, yaxis_type)
         # get the device name, override if necessary
-        if 'AF_LABEL' in benchmark['extra_data'].keys():
-            device = benchmark['extra_data']['AF_LABEL']
+        device = get_recordTable_attribute(benchmark, 'AF_LABEL', device)
 
-        source = bplt.ColumnDataSource(
-            data = dict(x=x,y=y,
-                device=[device]*len(x),
-                benchmark=[bmark_name]*len(x),
-                platform=[platform]*len(x),
-                os=[operating_system]*len(x),
-            ))
+        points['x'].append(x)
+        points['y'].append(y)
+        points['color'].append([color]*len(x))
+        points['device'].append([device]*len(x))
+        points['benchmark'].append([bmark_name]*len(x))
+        points['platform'].append([platform]*len(x))
+        points['os'].append([operating_system]*len(x))
 
         # Generate the legend, automatically add the platform if needed
 #        legend = device
         legend = device + " (" + platform + ") " + bmark_name
 
-        # generate the plot
-        plot.line(x,y, legend=legend, color=color, line_width=2)
-        sr = plot.scatter('x', 'y', source=source, legend=legend, color=color,
-            fill_color="white", size=8)
-        scatter_renderers.append(sr)
+        # generate the plot, lines with the same label share a legend entry
+        line = plot.line(x,y, color=color, line_width=2)
+        add_legend_entry(legends, legend, line)
 
-    hover = plot.select(HoverTool)
-    hover.renderers = scatter_renderers
+    # concatenate the per-benchmark columns into one data source
+    for key in points.keys():
+        points[key] = np.concatenate(points[key])
+
+    source = bplt.ColumnDataSource(data=points)
+    sr = plot.scatter('x', 'y', source=source, line_color='color',
+        fill_color="white", size=8)
+
+    hover.renderers = [sr]
 
     plot.xaxis.axis_label = xlabel
     plot.yaxis.axis_label = ylabel
-    plot.legend.location = legend_location
+    plot.add_layout(Legend(legends=legends, location=legend_location))
 
-    # save the plot
-    bplt.save(plot)
+    # save the plot, embedding BokehJS. Use resources=CDN to link it instead.
+    save(plot, filename=save_prefix + savefile + ".html", title=title,
+        resources=INLINE)
 
 def main():
 
@@ -430,7 +469,7 @@ def main():
     benchmarks = list()
     for file_or_directory in args.files:
         if os.path.isfile(file_or_directory):
-            benchmarks.extend( read_celero_recordTable(file_or_directory) )
+            benchmarks.extend( read_celero_recordTable_cached(file_or_directory) )
         else:
             benchmarks.extend( import_directory(file_or_directory) )
 
@@ -442,28 +481,28 @@ def main():
         groups = list_recordTable_benchmarks(benchmarks)
         for entry in groups:
             print(entry)
-        quit()
+        sys.exit()
 
     # list backends found in the data, then exit
     if args.list_backends:
         backends = list_recordTable_attribute(benchmarks, 'AF_PLATFORM')
         for entry in backends:
             print(entry)
-        quit()
+        sys.exit()
 
     # list all devices found in the data, then exit
     if args.list_devices:
         devices = list_recordTable_attribute(benchmarks, 'AF_DEVICE')
         for entry in devices:
             print(entry)
-        quit()
+        sys.exit()
 
     # list all devices found in the data, then exit
     if args.list_revisions:
         revisions = list_recordTable_attribute(benchmarks, 'AF_REVISION')
         for entry in revisions:
             print(entry)
-        quit()
+        sys.exit()
 
     # Apply any command-line argument filters
     benchmarks = filter_benchmarks(benchmarks,
@@ -480,27 +519,31 @@ def main():
     plot_benchmarks = list_recordTable_benchmarks(benchmarks)
 
     if args.merge_plots and len(plot_benchmarks) > 0:
-        # Custom plotting for merged plots
-        filtered_benchmarks = filter(lambda x: x['benchmark_name'] in plot_benchmarks, benchmarks)
-
+        # Custom plotting for merged plots, every filtered benchmark is plotted
         title = plot_benchmarks[0]
         if len(args.custom_title) > 0:
             title = args.custom_title
 
-        plot_merged_benchmark(plot_benchmarks[0], filtered_benchmarks, title,
+        plot_merged_benchmark(plot_benchmarks[0], benchmarks, title,
             args.xaxis, args.yaxis, save_prefix=args.save_prefix)
     else:
         # standard plotting, 1 benchmark -> 1 plot
-        for benchmark in plot_benchmarks:
+        # every plot shares the same device colors, unless there are more
+        # devices than colors. Then each plot assigns its own colors instead.
+        color_map = assign_colors(benchmarks)
+        if len(set(color_map.values())) < len(color_map):
+            color_map = None
+        table = recordTable_dataframe(benchmarks)
+        for benchmark, rows in table.groupby('benchmark_name'):
             # Get the benchmarks we will plot
-            filtered_benchmarks = filter(lambda x: x['benchmark_name'] == benchmark, benchmarks)
+            filtered_benchmarks = [benchmarks[i] for i in rows.index]
 
             title = benchmark
             if len(args.custom_title) > 0:
                 title = args.custom_title
 
             plot_benchmark(benchmark, filtered_benchmarks, title, args.xaxis, args.yaxis,
-                save_prefix=args.save_prefix)
+                save_prefix=args.save_prefix, color_map=color_map)
 
 
 def unique_benchmark(benchmark_list):
@@ -511,20 +554,9 @@ def unique_benchmark(benchmark_list):
     seen = set()
     new_l = []
     for d in benchmark_list:
-        try:
-            device = d['extra_data']['AF_DEVICE']
-        except:
-            device = ""
-
-        try:
-            platform = d['extra_data']['AF_PLATFORM']
-        except:
-            platform = ""
-
-        try:
-            OS = d['extra_data']['AF_OS']
-        except:
-            OS = ""
+        device = get_recordTable_attribute(d, 'AF_DEVICE', "")
+        platform = get_recordTable_attribute(d, 'AF_PLATFORM', "")
+        OS = get_recordTable_attribute(d, 'AF_OS', "")
 
         t = tuple(device + platform + OS)
         if t not in seen: